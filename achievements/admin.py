@@ -2,6 +2,6 @@ from django.contrib import admin
 
 from . import models
 
-model_list = [models.Achievement, models.AchievementProgress]
+model_list = [models.Achievement, models.AchievementProgress, models.ProgressVersion]
 
 admin.site.register(model_list)
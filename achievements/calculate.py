@@ -1,38 +1,67 @@
 from user_data import models as user_models
+from user_data.snapshot import get_snapshot
+
+# Achievement registry
+
+# Scheduling metadata for each achievement, keyed by the function name (Achievement.code)
+registry = {}
+
+
+def achievement(terminal_level=None, reads_user_data=True):
+    """
+    Register an achievement implementation with its scheduling metadata.
+
+    terminal_level is the level after which the result can never change, or None if it can always change.
+    reads_user_data is False for achievements that don't read the user's imported data, which are only calculated
+    once. Otherwise an achievement is recalculated whenever the user's DataVersion changes. Changes to the species
+    taxonomy don't make achievements stale.
+    """
+    def register(func):
+        func.terminal_level = terminal_level
+        func.reads_user_data = reads_user_data
+        registry[func.__name__] = func
+        return func
+    return register
+
 
 # Achievement Implementations
 
 # Achievements take a user as a parameter, and return the level & progress towards the next level
 
+@achievement(terminal_level=1)
 def canadensis(user):
-    canadensis = user_models.Species.objects.filter(scientific_name__contains='canadensis')
-    count_candensis = canadensis.count()
-    seen = user_models.Observation.objects.filter(user=user, species__in=canadensis).values_list('species__scientific_name', flat=True)
-    seen_count = len(set(seen))
+    canadensis = user_models.Species.objects.filter(scientific_name__contains='canadensis').values_list('taxonomic_order', flat=True)
+    count_candensis = len(canadensis)
+    seen_count = get_snapshot(user).seen_count(canadensis)
     # All
     if seen_count == count_candensis:
         return 1, None
     return 0, seen_count
 
+@achievement(terminal_level=5)
 def sparrows(user):
-    sparrows = user_models.Species.objects.filter(family__contains='Sparrows', category='species')
-    sparrows_count = sparrows.count()
-
-    seen = user_models.Observation.objects.filter(user=user, species__in=sparrows).values_list('species__scientific_name', flat=True)
-    seen_count = len(set(seen))
+    sparrows = user_models.Species.objects.filter(family__contains='Sparrows', category='species').values_list('taxonomic_order', flat=True)
+    sparrows_count = len(sparrows)
+    seen_count = get_snapshot(user).seen_count(sparrows)
 
     # Level: Progress to next level
     level_boundaries = [0, 5, 10, 50, 100, sparrows_count]
 
+    # All
+    if sparrows_count and seen_count == sparrows_count:
+        return len(level_boundaries) - 1, None
+
     for level, (lower, upper) in enumerate(zip(level_boundaries, level_boundaries[1:])):
         if lower < seen_count < upper:
             return level, seen_count - lower
 
     return 0, None
 
+@achievement(terminal_level=1)
 def bb24(user):
-    blackbirds = user_models.Species.objects.filter(common_name__contains='blackbird')
+    blackbirds = user_models.Species.objects.filter(common_name__contains='blackbird').values_list('taxonomic_order', flat=True)
+    snapshot = get_snapshot(user)
     # Any
-    if user_models.Observation.objects.filter(user=user, count__gte=24, species__in=blackbirds).exists():
+    if any((snapshot.max_count(b) or 0) >= 24 for b in blackbirds):
         return 1, None
     return 0, None
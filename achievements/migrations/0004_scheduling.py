@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('achievements', '0003_level_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='achievement',
+            name='cost_estimate',
+            field=models.FloatField(default=0, help_text='Measured time to calculate, in seconds'),
+        ),
+        migrations.AddField(
+            model_name='achievementprogress',
+            name='data_version',
+            field=models.PositiveIntegerField(blank=True, default=None, help_text='User data version this was calculated from', null=True),
+        ),
+    ]
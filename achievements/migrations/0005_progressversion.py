@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('achievements', '0004_scheduling'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProgressVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0, help_text="Incremented every time this user's achievement progress changes")),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='progress_version', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def remove_duplicates(apps, schema_editor):
+    # Keep the most recently created progress for each user and achievement
+    AchievementProgress = apps.get_model("achievements", "AchievementProgress")
+    duplicates = AchievementProgress.objects.values('user', 'achievement').annotate(
+        count=Count('id'), latest=Max('id')).filter(count__gt=1)
+    for row in duplicates:
+        AchievementProgress.objects.filter(user=row['user'], achievement=row['achievement']).exclude(
+            id=row['latest']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('achievements', '0005_progressversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='achievementprogress',
+            unique_together=set([('user', 'achievement')]),
+        ),
+    ]
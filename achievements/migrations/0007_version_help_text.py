@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 18:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('achievements', '0006_progress_unique'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='progressversion',
+            name='version',
+            field=models.PositiveIntegerField(default=0, help_text='Incremented every time this changes for the user'),
+        ),
+    ]
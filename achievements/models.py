@@ -1,10 +1,13 @@
 from django.db import models
 from django.conf import settings
 
+from user_data.models import UserVersion
+
 
 class Achievement(models.Model):
     name = models.TextField()
     code = models.TextField()  # Short internal reference code
+    cost_estimate = models.FloatField(default=0, help_text='Measured time to calculate, in seconds')
     # Name
     # Long description
     # Image
@@ -20,6 +23,15 @@ class AchievementProgress(models.Model):
     achievement = models.ForeignKey('Achievement')
     level = models.IntegerField(help_text='Level of the badge', default=1)
     progress = models.IntegerField(help_text='Progress towards next level', blank=True, null=True, default=None)
+    data_version = models.PositiveIntegerField(help_text='User data version this was calculated from', blank=True, null=True, default=None)
+
+    class Meta:
+        unique_together = ('user', 'achievement')
 
     def __str__(self):
         return '{s.user} has {s.achievement}'.format(s=self)
+
+
+class ProgressVersion(UserVersion):
+    """Bumped every time the user's achievement progress changes."""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, related_name='progress_version')
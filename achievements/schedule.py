@@ -0,0 +1,153 @@
+"""
+Decide which achievements to recalculate for a user, and in what order.
+
+Achievements already at their terminal level, and achievements whose user data has not changed since they were last
+calculated, are skipped. The rest are run cheapest first until the time budget is spent, and the remainder is
+deferred to a background pass.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from achievements import calculate
+from achievements import models
+from user_data import models as user_models
+
+# Weight given to the newest measurement when updating Achievement.cost_estimate
+COST_SMOOTHING = 0.3
+
+# Only store a new cost estimate when it differs from the stored one by more than this fraction
+COST_TOLERANCE = 0.2
+
+# User pk: IDs of the achievements a background pass in this process is calculating for them
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def get_function(achievement):
+    return calculate.registry.get(achievement.code) or getattr(calculate, achievement.code)
+
+
+def is_stale(achievement, progress, data_version):
+    """Return True if achievement needs to be calculated again given the user's existing progress."""
+    if progress is None:
+        return True
+    func = get_function(achievement)
+    terminal_level = getattr(func, 'terminal_level', None)
+    if terminal_level is not None and progress.level >= terminal_level:
+        return False
+    if not getattr(func, 'reads_user_data', True):
+        return False
+    return progress.data_version != data_version
+
+
+def plan(user):
+    """Return the achievements to calculate for user, cheapest first, and the current data version."""
+    data_version = user_models.DataVersion.current(user)
+    existing = {p.achievement_id: p for p in models.AchievementProgress.objects.filter(user=user)}
+    stale = [
+        achievement for achievement in models.Achievement.objects.order_by('cost_estimate', 'id')
+        if is_stale(achievement, existing.get(achievement.id), data_version)
+    ]
+    return stale, data_version
+
+
+def run(user, achievement, data_version):
+    """Calculate and store one achievement for user, returning how long the calculation took."""
+    func = get_function(achievement)
+    start = time.monotonic()
+    level, progress = func(user)
+    elapsed = time.monotonic() - start
+
+    existing = models.AchievementProgress.objects.filter(user=user, achievement=achievement)
+    if existing.values_list('level', 'progress').first() == (level, progress):
+        existing.update(data_version=data_version)
+    else:
+        models.AchievementProgress.objects.update_or_create(
+            user=user,
+            achievement=achievement,
+            defaults={
+                'level': level,
+                'progress': progress,
+                'data_version': data_version,
+            }
+        )
+        models.ProgressVersion.bump(user)
+    return elapsed
+
+
+def update_cost_estimates(timings):
+    """
+    Store new cost estimates from a list of (achievement, seconds) measured in one pass.
+
+    Only estimates that changed noticeably are written, all in one transaction, so calculating achievements doesn't
+    compete with imports for the database more than it has to.
+    """
+    changed = []
+    for achievement, elapsed in timings:
+        old = achievement.cost_estimate
+        cost = (1 - COST_SMOOTHING) * old + COST_SMOOTHING * elapsed if old else elapsed
+        if not old or abs(cost - old) > COST_TOLERANCE * old:
+            changed.append((achievement, cost))
+    if not changed:
+        return
+    with transaction.atomic():
+        for achievement, cost in changed:
+            models.Achievement.objects.filter(pk=achievement.pk).update(cost_estimate=cost)
+            achievement.cost_estimate = cost
+
+
+def calculate_achievements(user, budget=None):
+    """
+    Recalculate stale achievements for user within budget seconds.
+
+    Returns the list of achievements deferred to the background pass.
+    """
+    if budget is None:
+        budget = getattr(settings, 'ACHIEVEMENT_TIME_BUDGET', 2.0)
+    achievements, data_version = plan(user)
+    # Leave achievements a background pass is already calculating to it
+    with _in_flight_lock:
+        owned = set(_in_flight.get(user.pk, ()))
+    achievements = [a for a in achievements if a.id not in owned]
+
+    spent = 0
+    timings = []
+    for index, achievement in enumerate(achievements):
+        # Always make some progress, even if the first estimate is over budget
+        if index > 0 and spent + achievement.cost_estimate > budget:
+            deferred = achievements[index:]
+            break
+        elapsed = run(user, achievement, data_version)
+        timings.append((achievement, elapsed))
+        spent += elapsed
+    else:
+        deferred = []
+    update_cost_estimates(timings)
+
+    if deferred:
+        with _in_flight_lock:
+            claimed = _in_flight.setdefault(user.pk, set())
+            deferred = [a for a in deferred if a.id not in claimed]
+            claimed.update(a.id for a in deferred)
+    if deferred:
+        thread = threading.Thread(target=run_deferred, args=(user, deferred, data_version), daemon=True)
+        thread.start()
+    return deferred
+
+
+def run_deferred(user, achievements, data_version):
+    """Background pass for achievements that did not fit in the request's time budget."""
+    try:
+        timings = [(achievement, run(user, achievement, data_version)) for achievement in achievements]
+        update_cost_estimates(timings)
+    finally:
+        with _in_flight_lock:
+            claimed = _in_flight.get(user.pk, set())
+            claimed.difference_update(a.id for a in achievements)
+            if not claimed:
+                _in_flight.pop(user.pk, None)
+        # Threads get their own connection, which Django won't clean up
+        connection.close()
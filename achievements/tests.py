@@ -1,3 +1,318 @@
-from django.test import TestCase
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.shortcuts import reverse
+from django.test import SimpleTestCase, TestCase
+
+from achievements import calculate
+from achievements import models
+from achievements import schedule
+from user_data import models as user_models
+from user_data import snapshot
+from user_data.importer import write_export
+from user_data.views import parse_filestream
+
+
+def static():
+    pass
+
+
+def fake_achievement(id, cost_estimate=0):
+    return SimpleNamespace(id=id, code='achievement{}'.format(id), cost_estimate=cost_estimate)
+
+
+class IsStaleTest(SimpleTestCase):
+
+    def test_no_progress_yet(self):
+        achievement = SimpleNamespace(code='canadensis')
+        self.assertTrue(schedule.is_stale(achievement, None, 3))
+
+    def test_terminal_level(self):
+        achievement = SimpleNamespace(code='canadensis')
+        progress = SimpleNamespace(level=1, data_version=1)
+        self.assertFalse(schedule.is_stale(achievement, progress, 3))
+
+    def test_data_version(self):
+        achievement = SimpleNamespace(code='sparrows')
+        self.assertFalse(schedule.is_stale(achievement, SimpleNamespace(level=2, data_version=3), 3))
+        self.assertTrue(schedule.is_stale(achievement, SimpleNamespace(level=2, data_version=2), 3))
+        self.assertTrue(schedule.is_stale(achievement, SimpleNamespace(level=2, data_version=None), 3))
+
+    def test_no_user_data(self):
+        achievement = SimpleNamespace(code='static')
+        with mock.patch.dict(calculate.registry, {'static': calculate.achievement(reads_user_data=False)(static)}):
+            self.assertFalse(schedule.is_stale(achievement, SimpleNamespace(level=0, data_version=None), 3))
+
+
+class PlanTest(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('birder')
+        # Achievements are created by a data migration
+        for code, cost in (('bb24', 0.5), ('canadensis', 0.1), ('sparrows', 0.3)):
+            models.Achievement.objects.filter(code=code).update(cost_estimate=cost)
+
+    def test_cheapest_first(self):
+        achievements, data_version = schedule.plan(self.user)
+        self.assertEqual([a.code for a in achievements], ['canadensis', 'sparrows', 'bb24'])
+        self.assertEqual(data_version, 0)
+
+    def test_skips_terminal(self):
+        models.AchievementProgress.objects.create(
+            user=self.user, achievement=models.Achievement.objects.get(code='canadensis'), level=1)
+        achievements, _ = schedule.plan(self.user)
+        self.assertEqual([a.code for a in achievements], ['sparrows', 'bb24'])
+
+
+@mock.patch('achievements.schedule.update_cost_estimates')
+@mock.patch('achievements.schedule.threading.Thread')
+@mock.patch('achievements.schedule.run', side_effect=lambda user, achievement, data_version: achievement.cost_estimate)
+class CalculateAchievementsTest(SimpleTestCase):
+
+    def setUp(self):
+        self.user = SimpleNamespace(pk=1)
+        self.achievements = [fake_achievement(1, 0.1), fake_achievement(2, 1.0), fake_achievement(3, 5.0)]
+        patcher = mock.patch('achievements.schedule.plan', return_value=(self.achievements, 3))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(schedule._in_flight.clear)
+
+    def test_defers_over_budget(self, run, thread, update_cost_estimates):
+        deferred = schedule.calculate_achievements(self.user, budget=1.5)
+        self.assertEqual(deferred, self.achievements[2:])
+        self.assertEqual([c[0][1] for c in run.call_args_list], self.achievements[:2])
+        thread.assert_called_once_with(
+            target=schedule.run_deferred, args=(self.user, self.achievements[2:], 3), daemon=True)
+        thread.return_value.start.assert_called_once_with()
+        update_cost_estimates.assert_called_once_with([(self.achievements[0], 0.1), (self.achievements[1], 1.0)])
+
+    def test_within_budget(self, run, thread, update_cost_estimates):
+        self.assertEqual(schedule.calculate_achievements(self.user, budget=10), [])
+        self.assertEqual(run.call_count, 3)
+        thread.assert_not_called()
+
+    def test_always_runs_one(self, run, thread, update_cost_estimates):
+        deferred = schedule.calculate_achievements(self.user, budget=0)
+        self.assertEqual(run.call_count, 1)
+        self.assertEqual(deferred, self.achievements[1:])
+
+    def test_does_not_requeue_in_flight(self, run, thread, update_cost_estimates):
+        schedule.calculate_achievements(self.user, budget=1.5)
+        run.reset_mock()
+        thread.reset_mock()
+        # Background pass for achievement 3 hasn't finished
+        self.assertEqual(schedule.calculate_achievements(self.user, budget=1.5), [])
+        self.assertEqual([c[0][1] for c in run.call_args_list], self.achievements[:2])
+        thread.assert_not_called()
+
+    def test_background_pass_releases(self, run, thread, update_cost_estimates):
+        deferred = schedule.calculate_achievements(self.user, budget=1.5)
+        with mock.patch('achievements.schedule.connection'):
+            schedule.run_deferred(self.user, deferred, 3)
+        self.assertNotIn(self.user.pk, schedule._in_flight)
+        update_cost_estimates.assert_called_with([(self.achievements[2], 5.0)])
+
+
+class UpdateCostEstimatesTest(TestCase):
+
+    def setUp(self):
+        self.achievement = models.Achievement.objects.get(code='sparrows')
+        models.Achievement.objects.filter(pk=self.achievement.pk).update(cost_estimate=1.0)
+        self.achievement.cost_estimate = 1.0
+
+    def stored(self):
+        return models.Achievement.objects.get(pk=self.achievement.pk).cost_estimate
+
+    def test_small_change_not_written(self):
+        with self.assertNumQueries(0):
+            schedule.update_cost_estimates([(self.achievement, 1.5)])
+        self.assertEqual(self.stored(), 1.0)
+
+    def test_large_change_written(self):
+        schedule.update_cost_estimates([(self.achievement, 3.0)])
+        self.assertAlmostEqual(self.stored(), 1.6)
+        self.assertAlmostEqual(self.achievement.cost_estimate, 1.6)
+
+    def test_first_measurement_written(self):
+        models.Achievement.objects.filter(pk=self.achievement.pk).update(cost_estimate=0)
+        self.achievement.cost_estimate = 0
+        schedule.update_cost_estimates([(self.achievement, 0.25)])
+        self.assertEqual(self.stored(), 0.25)
+
+
+# The achievements as they were calculated before snapshots, straight from observations
+
+def query_canadensis(user):
+    canadensis = user_models.Species.objects.filter(scientific_name__contains='canadensis')
+    seen = user_models.Observation.objects.filter(user=user, species__in=canadensis).values_list('species__scientific_name', flat=True)
+    seen_count = len(set(seen))
+    if seen_count == canadensis.count():
+        return 1, None
+    return 0, seen_count
+
+
+def query_sparrows(user):
+    sparrows = user_models.Species.objects.filter(family__contains='Sparrows', category='species')
+    sparrows_count = sparrows.count()
+    seen = user_models.Observation.objects.filter(user=user, species__in=sparrows).values_list('species__scientific_name', flat=True)
+    seen_count = len(set(seen))
+    level_boundaries = [0, 5, 10, 50, 100, sparrows_count]
+    if sparrows_count and seen_count == sparrows_count:
+        return len(level_boundaries) - 1, None
+    for level, (lower, upper) in enumerate(zip(level_boundaries, level_boundaries[1:])):
+        if lower < seen_count < upper:
+            return level, seen_count - lower
+    return 0, None
+
+
+def query_bb24(user):
+    blackbirds = user_models.Species.objects.filter(common_name__contains='blackbird')
+    if user_models.Observation.objects.filter(user=user, count__gte=24, species__in=blackbirds).exists():
+        return 1, None
+    return 0, None
+
+
+SPECIES = [
+    # taxonomic_order, scientific_name, common_name, family, category
+    ('173', 'Branta canadensis', 'Canada Goose', 'Anatidae (Ducks, Geese, and Waterfowl)', 'species'),
+    ('2891', 'Antigone canadensis', 'Sandhill Crane', 'Gruidae (Cranes)', 'species'),
+    ('32380', 'Spizella passerina', 'Chipping Sparrow', 'Passerellidae (New World Sparrows)', 'species'),
+    ('32560', 'Passerculus sandwichensis', 'Savannah Sparrow', 'Passerellidae (New World Sparrows)', 'species'),
+    ('32570', 'Junco hyemalis', 'Dark-eyed Junco', 'Passerellidae (New World Sparrows)', 'species'),
+    ('32580', 'Junco hyemalis oreganus/montanus', 'Dark-eyed Junco (Oregon)', 'Passerellidae (New World Sparrows)', 'issf'),
+    ('32660', 'Zonotrichia leucophrys', 'White-crowned Sparrow', 'Passerellidae (New World Sparrows)', 'species'),
+    ('32720', 'Melospiza melodia', 'Song Sparrow', 'Passerellidae (New World Sparrows)', 'species'),
+    ('32730', 'Melospiza lincolnii', "Lincoln's Sparrow", 'Passerellidae (New World Sparrows)', 'species'),
+    # Lower case so the case sensitivity of contains doesn't matter
+    ('33390', 'Agelaius phoeniceus', 'Red-winged blackbird', 'Icteridae (Troupials and Allies)', 'species'),
+]
+
+
+class SnapshotCalculationTest(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('birder')
+        for taxonomic_order, scientific_name, common_name, family, category in SPECIES:
+            user_models.Species.objects.create(
+                taxonomic_order=Decimal(taxonomic_order),
+                category=category,
+                scientific_name=scientific_name,
+                common_name=common_name,
+                ioc_name=common_name,
+                family=family,
+            )
+        self.addCleanup(snapshot.cache.clear)
+        snapshot.cache.clear()
+
+    def import_rows(self, *rows):
+        parse_filestream(write_export(rows), self.user)
+
+    def assertSameAsQueries(self, expected):
+        calculated = {
+            'canadensis': calculate.canadensis(self.user),
+            'sparrows': calculate.sparrows(self.user),
+            'bb24': calculate.bb24(self.user),
+        }
+        queried = {
+            'canadensis': query_canadensis(self.user),
+            'sparrows': query_sparrows(self.user),
+            'bb24': query_bb24(self.user),
+        }
+        self.assertEqual(calculated, queried)
+        self.assertEqual(calculated, expected)
+
+    def test_snapshot_rebuilt_on_new_data(self):
+        self.import_rows(
+            {'Scientific Name': 'Branta canadensis', 'Count': '3'},
+            {'Scientific Name': 'Melospiza melodia'},
+            {'Scientific Name': 'Zonotrichia leucophrys'},
+            {'Scientific Name': 'Junco hyemalis oreganus/montanus'},
+            {'Scientific Name': 'Agelaius phoeniceus', 'Count': 'X'},
+            {'Submission ID': 'S2', 'Scientific Name': 'Agelaius phoeniceus', 'Count': '10'},
+        )
+        snap = snapshot.get_snapshot(self.user)
+        self.assertEqual(snap.version, user_models.DataVersion.current(self.user))
+        self.assertEqual((snap.life_list, snap.checklists, snap.observations), (4, 2, 6))
+        self.assertEqual(snap.max_count(Decimal('173')), 3)
+        self.assertEqual(snap.max_count(Decimal('33390')), 10)
+        self.assertIsNone(snap.max_count(Decimal('2891')))
+        self.assertIs(snapshot.get_snapshot(self.user), snap)
+        self.assertSameAsQueries({'canadensis': (0, 1), 'sparrows': (0, 2), 'bb24': (0, None)})
+
+        misses = snapshot.cache.misses
+        user_models.DataVersion.bump(self.user)
+        rebuilt = snapshot.get_snapshot(self.user)
+        self.assertIsNot(rebuilt, snap)
+        self.assertEqual(rebuilt.version, snap.version + 1)
+        self.assertEqual(snapshot.cache.misses, misses + 1)
+
+        self.import_rows(
+            {'Submission ID': 'S3', 'Scientific Name': 'Antigone canadensis'},
+            {'Submission ID': 'S3', 'Scientific Name': 'Spizella passerina'},
+            {'Submission ID': 'S3', 'Scientific Name': 'Passerculus sandwichensis'},
+            {'Submission ID': 'S3', 'Scientific Name': 'Junco hyemalis'},
+            {'Submission ID': 'S3', 'Scientific Name': 'Melospiza lincolnii'},
+            {'Submission ID': 'S3', 'Scientific Name': 'Agelaius phoeniceus', 'Count': '30'},
+        )
+        snap = snapshot.get_snapshot(self.user)
+        self.assertEqual(snap.version, rebuilt.version + 1)
+        self.assertEqual((snap.life_list, snap.checklists, snap.observations), (9, 3, 12))
+        self.assertEqual(snap.max_count(Decimal('33390')), 30)
+        self.assertSameAsQueries({'canadensis': (1, None), 'sparrows': (5, None), 'bb24': (1, None)})
+
+
+class ProgressAPITest(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('birder', password='password')
+        self.client.login(username='birder', password='password')
+        models.AchievementProgress.objects.create(
+            user=self.user, achievement=models.Achievement.objects.get(code='bb24'), level=1)
+        models.AchievementProgress.objects.create(
+            user=self.user, achievement=models.Achievement.objects.get(code='sparrows'), level=0, progress=3)
+        self.addCleanup(snapshot.cache.clear)
+        snapshot.cache.clear()
+
+    def get(self, **kwargs):
+        return self.client.get(reverse('progress_api'), **kwargs)
+
+    def test_payload(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['achievements'], [{'code': 'bb24', 'name': '4 and 20 blackbirds', 'level': 1, 'progress': None}])
+        self.assertEqual([p['code'] for p in data['upcoming']], ['sparrows'])
+        self.assertEqual(data['life_list'], {'species': 0, 'checklists': 0, 'observations': 0})
+
+    def test_fields(self):
+        response = self.client.get(reverse('progress_api'), {'fields': 'upcoming,life_list'})
+        self.assertEqual(set(response.json()), {'upcoming', 'life_list'})
+
+    def test_unknown_fields(self):
+        etag = self.get()['ETag']
+        for fields in ('nonsense', 'achievements,typo'):
+            response = self.client.get(reverse('progress_api'), {'fields': fields}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 400, fields)
+
+    def test_not_modified(self):
+        etag = self.get()['ETag']
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes(self):
+        etag = self.get()['ETag']
+        models.ProgressVersion.bump(self.user)
+        progress_etag = self.get()['ETag']
+        self.assertNotEqual(progress_etag, etag)
+        user_models.DataVersion.bump(self.user)
+        self.assertNotEqual(self.get()['ETag'], progress_etag)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_per_user(self):
+        etag = self.get()['ETag']
+        get_user_model().objects.create_user('other', password='password')
+        self.client.login(username='other', password='password')
+        self.assertNotEqual(self.get()['ETag'], etag)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 200)
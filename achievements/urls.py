@@ -5,4 +5,5 @@ from . import views
 urlpatterns = [
     url(r'^$', views.AchievementProgressList.as_view(), name='progress_list'),
     url(r'^calculate/$', views.calculate_achievements, name='calculate_achievements'),
+    url(r'^api/progress/$', views.progress_api, name='progress_api'),
 ]
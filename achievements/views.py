@@ -1,11 +1,17 @@
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, JsonResponse
 from django.shortcuts import render, reverse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET
 from django.views.generic import ListView
 
 from achievements import models
-from achievements import calculate
+from achievements import schedule
+from user_data import models as user_models
+from user_data.snapshot import get_snapshot
+
+API_FIELDS = ('achievements', 'upcoming', 'life_list')
 
 
 class AchievementProgressList(LoginRequiredMixin, ListView):
@@ -17,25 +23,72 @@ class AchievementProgressList(LoginRequiredMixin, ListView):
     def get_context_data(self, **kwargs):
         context = super(AchievementProgressList, self).get_context_data(**kwargs)
         # Add some upcoming achievements
-        context['upcoming_achievements'] = models.AchievementProgress.objects.filter(user=self.request.user, level=0, progress__isnull=False)[:3]
+        context['upcoming_achievements'] = upcoming_achievements(self.request.user)
         return context
 
+
+def upcoming_achievements(user):
+    return models.AchievementProgress.objects.filter(user=user, level=0, progress__isnull=False).select_related('achievement')[:3]
+
 @login_required
 def calculate_achievements(request):
-    user = request.user
-    print('request user', user)
-    for achievement in models.Achievement.objects.all():
-        print(achievement)
-        func = getattr(calculate, achievement.code)
-        level, progress = func(user)
-        print(level, progress)
-        if level > 0 or progress is not None:
-            models.AchievementProgress.objects.update_or_create(
-                user=user,
-                achievement=achievement,
-                defaults={
-                    'level': level,
-                    'progress': progress,
-                }
-            )
+    schedule.calculate_achievements(request.user)
     return HttpResponseRedirect(reverse('progress_list'))
+
+
+def api_fields(request):
+    """Return the fields requested with ?fields=a,b, all fields if there is no ?fields=, or None if any are unknown."""
+    fields = request.GET.get('fields')
+    if not fields:
+        return API_FIELDS
+    requested = fields.split(',')
+    if not set(requested) <= set(API_FIELDS):
+        return None
+    return tuple(f for f in API_FIELDS if f in requested)
+
+
+def progress_etag(request):
+    fields = api_fields(request)
+    if not fields:
+        return None  # Bad request, never a 304
+    # Only changes when the user's progress or imported data do
+    return '{}-{}-{}-{}'.format(
+        request.user.pk,
+        models.ProgressVersion.current(request.user),
+        user_models.DataVersion.current(request.user),
+        '.'.join(fields),
+    )
+
+
+def serialize_progress(progress):
+    return {
+        'code': progress.achievement.code,
+        'name': progress.achievement.name,
+        'level': progress.level,
+        'progress': progress.progress,
+    }
+
+
+@login_required
+@require_GET
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=progress_etag)
+def progress_api(request):
+    user = request.user
+    data = {}
+    fields = api_fields(request)
+    if not fields:
+        return JsonResponse({'error': 'fields must only be some of: {}'.format(','.join(API_FIELDS))}, status=400)
+    if 'achievements' in fields:
+        achieved = models.AchievementProgress.objects.filter(user=user, level__gte=1).select_related('achievement')
+        data['achievements'] = [serialize_progress(p) for p in achieved]
+    if 'upcoming' in fields:
+        data['upcoming'] = [serialize_progress(p) for p in upcoming_achievements(user)]
+    if 'life_list' in fields:
+        snapshot = get_snapshot(user)
+        data['life_list'] = {
+            'species': snapshot.life_list,
+            'checklists': snapshot.checklists,
+            'observations': snapshot.observations,
+        }
+    return JsonResponse(data, json_dumps_params={'separators': (',', ':')})
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Time importing a generated eBird export, to compare database backends.
+
+The database must be migrated and have the species taxonomy loaded. A temporary user is created for the import and
+deleted, with all their data, afterwards.
+
+Usage:
+    scripts/benchmark_import.py [rows]
+
+Compare SQLite and PostGIS with eg:
+    DJANGO_SETTINGS_MODULE=settings.production scripts/benchmark_import.py 50000
+    DJANGO_SETTINGS_MODULE=settings.postgis DATABASE_NAME=feathers_bench scripts/benchmark_import.py 50000
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings.development')
+
+import django
+django.setup()
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+
+from user_data import models
+from user_data.importer import write_export
+from user_data.views import parse_filestream
+
+ROWS_PER_CHECKLIST = 25
+
+
+def make_export(rows):
+    species = list(models.Species.objects.values_list('scientific_name', flat=True)[:2000])
+    if len(species) < ROWS_PER_CHECKLIST:
+        sys.exit('Load the species taxonomy first')
+    # Start well past any real checklist IDs
+    first_checklist = 10 ** 9 + random.randint(0, 10 ** 8)
+
+    def changes():
+        for checklist in range(0, rows // ROWS_PER_CHECKLIST + 1):
+            location = random.randint(0, 500)
+            for name in random.sample(species, min(ROWS_PER_CHECKLIST, rows - checklist * ROWS_PER_CHECKLIST)):
+                yield {
+                    'Submission ID': 'S{}'.format(first_checklist + checklist),
+                    'Scientific Name': name,
+                    'Count': random.choice(['X', '1', '2', '5', '24']),
+                    'Location': 'Benchmark location {}'.format(location),
+                    'Latitude': '{:.6f}'.format(49 + location / 1000),
+                    'Longitude': '{:.6f}'.format(-123 - location / 1000),
+                }
+    return write_export(changes())
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    export = make_export(rows)
+    user = get_user_model().objects.create_user('benchmark-{}'.format(int(time.time())))
+    try:
+        start = time.monotonic()
+        parse_filestream(export, user)
+        elapsed = time.monotonic() - start
+        imported = models.Observation.objects.filter(user=user).count()
+        print('{}: imported {} observations in {:.1f}s ({:.0f} rows/s)'.format(
+            connection.vendor, imported, elapsed, rows / elapsed))
+    finally:
+        models.Observation.objects.filter(user=user).delete()
+        models.Checklist.objects.filter(user=user).delete()
+        models.Location.objects.filter(locality__startswith='Benchmark location ').delete()
+        user.delete()
+
+
+if __name__ == '__main__':
+    main()
@@ -81,6 +81,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.contrib.gis.db.backends.spatialite',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'TEST': {
+            # A file, not the default in-memory test database, so tests can use WAL and several connections
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
     }
 }
 
@@ -107,6 +111,14 @@ LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'progress_list'
 LOGOUT_REDIRECT_URL = '/'
 
+# Seconds of achievement calculation to do in a request before deferring the rest to the background
+ACHIEVEMENT_TIME_BUDGET = 2.0
+
+# Memory for per-user observation snapshots (see user_data.snapshot) in each process, and optionally a cache alias
+# from CACHES to share them between processes
+SNAPSHOT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+SNAPSHOT_CACHE_BACKEND = None
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.11/topics/i18n/
 
@@ -0,0 +1,25 @@
+"""Production settings for PostgreSQL with PostGIS."""
+from __future__ import absolute_import
+
+from .production import *
+
+
+# Database
+# https://docs.djangoproject.com/en/1.11/ref/contrib/gis/install/postgis/
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.contrib.gis.db.backends.postgis',
+        'NAME': os.environ.get('DATABASE_NAME', 'feathers'),
+        'USER': os.environ.get('DATABASE_USER', ''),
+        'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+        'HOST': os.environ.get('DATABASE_HOST', ''),
+        'PORT': os.environ.get('DATABASE_PORT', ''),
+        'CONN_MAX_AGE': 600,
+    }
+}
+
+SQLITE_PRAGMAS = []
+
+# Imports are loaded with COPY (see user_data.bulk), which is efficient with much larger batches
+IMPORT_BATCH_SIZE = 10000
@@ -4,3 +4,29 @@ from __future__ import absolute_import
 from .base import *
 
 DEBUG = False
+
+
+# Database
+# Imports write while other users read their achievements, so use WAL to let readers carry on during a write, and
+# wait for the write lock instead of failing immediately with "database is locked".
+# https://www.sqlite.org/wal.html
+
+DATABASES['default'].update({
+    'CONN_MAX_AGE': 600,
+    'OPTIONS': {
+        'timeout': 20,  # Seconds to wait for the write lock
+    },
+})
+
+# Applied to every new SQLite connection, see user_data.db
+SQLITE_PRAGMAS = [
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),  # Safe with WAL, only the last transactions may be lost on power failure
+    ('mmap_size', 256 * 1024 * 1024),
+    ('cache_size', -64 * 1024),  # Negative is in KiB
+    ('temp_store', 'MEMORY'),
+]
+
+# Rows committed per transaction by the eBird importer, and how often to retry a batch if the database is locked
+IMPORT_BATCH_SIZE = 500
+IMPORT_LOCKED_RETRIES = 5
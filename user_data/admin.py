@@ -2,6 +2,6 @@ from django.contrib import admin
 
 from . import models
 
-model_list = [models.Species, models.Location, models.Checklist, models.Observation]
+model_list = [models.Species, models.Location, models.Checklist, models.Observation, models.DataVersion]
 
 admin.site.register(model_list)
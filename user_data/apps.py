@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class UserDataConfig(AppConfig):
-    name = "User's bird observation data"
+    name = 'user_data'
+    verbose_name = "User's bird observation data"
+
+    def ready(self):
+        from . import db
+        connection_created.connect(db.set_sqlite_pragmas)
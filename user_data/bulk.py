@@ -0,0 +1,156 @@
+"""
+Bulk eBird import for PostgreSQL/PostGIS.
+
+Each batch is loaded with COPY into a temporary staging table, then merged into the real tables with a few set-based
+INSERT ... ON CONFLICT statements, instead of three get_or_create calls per row.
+"""
+import csv
+import io
+
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from . import models
+from .importer import checklist_fields, observation_fields
+
+STAGING_COLUMNS = [
+    ('checklist_id', 'integer'),
+    ('scientific_name', 'text'),
+    ('longitude', 'double precision'),
+    ('latitude', 'double precision'),
+    ('locality', 'text'),
+    ('state_province', 'text'),
+    ('county', 'text'),
+    ('complete_checklist', 'boolean'),
+    ('start_date_time', 'timestamp with time zone'),
+    ('checklist_comments', 'text'),
+    ('number_of_observers', 'integer'),
+    ('protocol', 'text'),
+    ('duration', 'interval'),
+    ('distance', 'numeric'),
+    ('area', 'numeric'),
+    ('count', 'integer'),
+    ('presence', 'boolean'),
+    ('species_comments', 'text'),
+    ('breeding_atlas_code', 'text'),
+]
+
+STAGING_TABLE = 'user_data_import_staging'
+
+# COPY's default NULL in CSV is an unquoted empty field, which would turn blank text like County into NULL too
+NULL = r'\N'
+
+
+def staging_row(entry):
+    row = {
+        'checklist_id': int(entry['Submission ID'][1:]),  # Strip leading S
+        'scientific_name': entry['Scientific Name'],
+        'longitude': float(entry['Longitude']),
+        'latitude': float(entry['Latitude']),
+        'locality': entry['Location'],
+        'state_province': entry['State/Province'],
+        'county': entry['County'],
+    }
+    row.update(checklist_fields(entry))
+    row.update(observation_fields(entry))
+    if timezone.is_naive(row['start_date_time']):
+        row['start_date_time'] = timezone.make_aware(row['start_date_time'])
+    row['start_date_time'] = row['start_date_time'].isoformat()
+    if row['duration'] is not None:
+        row['duration'] = '{} seconds'.format(row['duration'].total_seconds())
+    return [NULL if row[column] is None else row[column] for column, _ in STAGING_COLUMNS]
+
+
+def copy_to_staging(cursor, batch):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for entry in batch:
+        writer.writerow(staging_row(entry))
+    buf.seek(0)
+    cursor.copy_expert("COPY {} FROM STDIN WITH (FORMAT csv, NULL '{}')".format(STAGING_TABLE, NULL), buf)
+
+
+@transaction.atomic
+def parse_batch(batch, user):
+    tables = {
+        'staging': STAGING_TABLE,
+        'species': models.Species._meta.db_table,
+        'location': models.Location._meta.db_table,
+        'checklist': models.Checklist._meta.db_table,
+        'observation': models.Observation._meta.db_table,
+    }
+    point = 'ST_SetSRID(ST_MakePoint(s.longitude, s.latitude), 4326)'
+    with connection.cursor() as cursor:
+        # Left over if this batch is inside an outer transaction with an earlier one
+        cursor.execute('DROP TABLE IF EXISTS {}'.format(STAGING_TABLE))
+        cursor.execute('CREATE TEMPORARY TABLE {} ({}) ON COMMIT DROP'.format(
+            STAGING_TABLE, ', '.join('{} {}'.format(*c) for c in STAGING_COLUMNS)))
+        copy_to_staging(cursor, batch)
+
+        # Same error as the row-by-row import
+        cursor.execute('''
+            SELECT s.scientific_name FROM {staging} s
+            LEFT JOIN {species} sp ON sp.scientific_name = s.scientific_name
+            WHERE sp.scientific_name IS NULL LIMIT 1
+        '''.format(**tables))
+        unknown = cursor.fetchone()
+        if unknown:
+            raise models.Species.DoesNotExist('Unknown species: {}'.format(unknown[0]))
+
+        # The row-by-row import fails on another user's checklist ID too, instead of skipping it
+        cursor.execute('''
+            SELECT s.checklist_id FROM {staging} s
+            JOIN {checklist} c ON c.id = s.checklist_id
+            WHERE c.user_id <> %s LIMIT 1
+        '''.format(**tables), [user.id])
+        conflict = cursor.fetchone()
+        if conflict:
+            raise IntegrityError('Checklist S{} belongs to another user'.format(conflict[0]))
+
+        # Nor will it move a checklist to another location, whether it was stored earlier or is in this batch
+        cursor.execute('''
+            SELECT s.checklist_id FROM {staging} s
+            LEFT JOIN {checklist} c ON c.id = s.checklist_id
+            LEFT JOIN {location} l ON l.id = c.location_id
+            GROUP BY s.checklist_id
+            HAVING count(DISTINCT (s.locality, s.longitude, s.latitude)) > 1
+                OR bool_or(l.id IS NOT NULL AND NOT (l.locality = s.locality AND l.coords ~= {point}))
+            LIMIT 1
+        '''.format(point=point, **tables))
+        conflict = cursor.fetchone()
+        if conflict:
+            raise IntegrityError('Checklist S{} is at more than one location'.format(conflict[0]))
+
+        # Location has no unique constraint to conflict on, so only insert ones not already there. ~= is the same
+        # equality the ORM uses for geometry lookups.
+        cursor.execute('''
+            INSERT INTO {location} (coords, state_province, county, locality)
+            SELECT DISTINCT ON (s.longitude, s.latitude, s.locality) {point}, s.state_province, s.county, s.locality
+            FROM {staging} s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {location} l WHERE l.locality = s.locality AND l.coords ~= {point}
+            )
+        '''.format(point=point, **tables))
+
+        cursor.execute('''
+            INSERT INTO {checklist} (id, user_id, location_id, complete_checklist, start_date_time,
+                checklist_comments, number_of_observers, protocol, duration, distance, area)
+            SELECT DISTINCT ON (s.checklist_id) s.checklist_id, %s, l.id, s.complete_checklist, s.start_date_time,
+                s.checklist_comments, s.number_of_observers, s.protocol, s.duration, s.distance, s.area
+            FROM {staging} s
+            JOIN {location} l ON l.locality = s.locality AND l.coords ~= {point}
+            ORDER BY s.checklist_id, l.id
+            ON CONFLICT (id) DO NOTHING
+        '''.format(point=point, **tables), [user.id])
+
+        cursor.execute('''
+            INSERT INTO {observation} (user_id, checklist_id, species_id, count, presence, species_comments,
+                breeding_atlas_code)
+            SELECT DISTINCT ON (s.checklist_id, sp.taxonomic_order) %s, s.checklist_id, sp.taxonomic_order, s.count,
+                s.presence, s.species_comments, s.breeding_atlas_code
+            FROM {staging} s
+            JOIN {species} sp ON sp.scientific_name = s.scientific_name
+            JOIN {checklist} c ON c.id = s.checklist_id AND c.user_id = %s
+            ORDER BY s.checklist_id, sp.taxonomic_order
+            ON CONFLICT (user_id, checklist_id, species_id) DO NOTHING
+        '''.format(**tables), [user.id, user.id])
@@ -0,0 +1,37 @@
+"""
+Database connection tuning and lock handling.
+"""
+import time
+
+from django.conf import settings
+from django.db import OperationalError
+
+
+def set_sqlite_pragmas(sender, connection, **kwargs):
+    """Apply settings.SQLITE_PRAGMAS to every new SQLite connection."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', []):
+            cursor.execute('PRAGMA {}={}'.format(pragma, value))
+
+
+def is_locked(error):
+    return 'database is locked' in str(error)
+
+
+def retry_on_locked(func, retries=None, delay=0.5):
+    """
+    Call func, retrying if SQLite reports the database is locked.
+
+    func must be safe to repeat, eg it runs in its own transaction. The delay doubles after every attempt.
+    """
+    if retries is None:
+        retries = getattr(settings, 'IMPORT_LOCKED_RETRIES', 0)
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except OperationalError as e:
+            if not is_locked(e) or attempt == retries:
+                raise
+            time.sleep(delay * 2 ** attempt)
@@ -0,0 +1,87 @@
+"""
+Conversion of eBird export rows to model fields, shared by the row-by-row and bulk imports.
+"""
+import csv
+import datetime
+from decimal import Decimal
+import io
+
+from dateutil.parser import parse
+
+from .validate import REQUIRED_COLUMNS
+
+
+def decimal_or_none(d):
+    if d:
+        return Decimal(d)
+    else:
+        return None
+
+
+def checklist_fields(entry):
+    start = parse(entry['Date'] + ' ' + entry['Time'])
+    if entry['Duration (Min)']:
+        duration = datetime.timedelta(minutes=int(entry['Duration (Min)']))
+    else:
+        duration = None
+
+    return {
+        'complete_checklist': True if entry['All Obs Reported'] == '1' else False,
+        'start_date_time': start,
+        'checklist_comments': entry['Checklist Comments'] or '',
+        'number_of_observers': entry['Number of Observers'] or None,
+        'protocol': entry['Protocol'],
+        'duration': duration,
+        'distance': decimal_or_none(entry['Distance Traveled (km)']),
+        'area': decimal_or_none(entry['Area Covered (ha)']),
+    }
+
+
+def observation_fields(entry):
+    if entry['Count'] == 'X':
+        count = None
+    else:
+        count = int(entry['Count'])
+    return {
+        'count': count,
+        'presence': entry['Count'] != '0',
+        'species_comments': entry['Species Comments'] or '',
+        'breeding_atlas_code': entry['Breeding Code'] or '',
+    }
+
+
+# A complete export row, for generating test and benchmark exports
+EXAMPLE_ROW = {
+    'Submission ID': 'S1',
+    'Scientific Name': 'Turdus migratorius',
+    'Count': '1',
+    'State/Province': 'CA-BC',
+    'County': 'Greater Vancouver',
+    'Location': 'Location 0',
+    'Latitude': '49.2',
+    'Longitude': '-123.1',
+    'Date': '2017-06-01',
+    'Time': '07:00 AM',
+    'Protocol': 'eBird - Traveling Count',
+    'Duration (Min)': '60',
+    'All Obs Reported': '1',
+    'Distance Traveled (km)': '1.5',
+    'Area Covered (ha)': '',
+    'Number of Observers': '1',
+    'Breeding Code': '',
+    'Species Comments': '',
+    'Checklist Comments': '',
+}
+
+
+def write_export(rows, fieldnames=REQUIRED_COLUMNS):
+    """Return an eBird export CSV with a row for each dict of changes to EXAMPLE_ROW."""
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=fieldnames, extrasaction='ignore')
+    writer.writeheader()
+    for changes in rows:
+        row = dict(EXAMPLE_ROW)
+        row.update(changes)
+        writer.writerow(row)
+    output.seek(0)
+    return output
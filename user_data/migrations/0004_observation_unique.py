@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def remove_duplicates(apps, schema_editor):
+    # Keep the most recently imported observation of each species on a checklist
+    Observation = apps.get_model("user_data", "Observation")
+    duplicates = Observation.objects.values('user', 'checklist', 'species').annotate(
+        count=Count('id'), latest=Max('id')).filter(count__gt=1)
+    for row in duplicates:
+        Observation.objects.filter(user=row['user'], checklist=row['checklist'], species=row['species']).exclude(
+            id=row['latest']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('user_data', '0003_dataversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='observation',
+            unique_together=set([('user', 'checklist', 'species')]),
+        ),
+    ]
@@ -60,5 +60,35 @@ class Observation(models.Model):
     species_comments = models.TextField()
     breeding_atlas_code = models.TextField(blank=True)  # Use choices
 
+    class Meta:
+        unique_together = ('user', 'checklist', 'species')
+
     def __str__(self):
         return '{s.user} observed {s.count} {s.species} on {s.checklist.start_date_time}'.format(s=self)
+
+
+class UserVersion(models.Model):
+    """A per-user counter, incremented every time something about the user changes."""
+    version = models.PositiveIntegerField(default=0, help_text='Incremented every time this changes for the user')
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return '{s.user} {s._meta.verbose_name} {s.version}'.format(s=self)
+
+    @classmethod
+    def current(cls, user):
+        """Return the user's current version, 0 if it has never been bumped."""
+        return cls.objects.filter(user=user).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def bump(cls, user):
+        """Mark the user's version as changed."""
+        version, _ = cls.objects.get_or_create(user=user)
+        cls.objects.filter(pk=version.pk).update(version=models.F('version') + 1)
+
+
+class DataVersion(UserVersion):
+    """Bumped every time data is imported for the user."""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, related_name='data_version')
@@ -0,0 +1,172 @@
+"""
+Per-user snapshots of observation data, cached in memory.
+
+A snapshot is a compact summary of a user's observations: which species they have seen and the highest count of
+each. It is built once per data version (see DataVersion), so an import makes the old one stale automatically.
+Snapshots are kept in a least recently used cache bounded by settings.SNAPSHOT_CACHE_MAX_BYTES, and optionally also
+stored in the Django cache named by settings.SNAPSHOT_CACHE_BACKEND so other processes can share them.
+"""
+from array import array
+import bisect
+import collections
+import sys
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Max
+
+from . import models
+
+# Stored in max_counts for species only ever recorded as present (X)
+PRESENT = -1
+
+
+class ObservationSnapshot(object):
+    __slots__ = ('user_id', 'version', 'species', 'max_counts', 'life_list', 'checklists', 'observations')
+
+    def __init__(self, user_id, version, species, max_counts, life_list, checklists, observations):
+        self.user_id = user_id
+        self.version = version
+        self.species = species  # Sorted taxonomic orders, as floats
+        self.max_counts = max_counts  # Highest count of each species, or PRESENT
+        self.life_list = life_list  # Number of species seen, excluding issf, spuhs, etc
+        self.checklists = checklists
+        self.observations = observations
+
+    def __str__(self):
+        return 'Snapshot of user {s.user_id} at version {s.version}'.format(s=self)
+
+    @classmethod
+    def build(cls, user_id, version):
+        observations = models.Observation.objects.filter(user_id=user_id)
+        by_species = observations.values_list('species_id').annotate(max_count=Max('count')).order_by('species_id')
+        species = array('d')
+        max_counts = array('l')
+        for taxonomic_order, max_count in by_species:
+            species.append(float(taxonomic_order))
+            max_counts.append(PRESENT if max_count is None else max_count)
+        return cls(
+            user_id=user_id,
+            version=version,
+            species=species,
+            max_counts=max_counts,
+            life_list=observations.filter(species__category='species').values('species').distinct().count(),
+            checklists=models.Checklist.objects.filter(user_id=user_id).count(),
+            observations=observations.count(),
+        )
+
+    @property
+    def nbytes(self):
+        """Approximate memory used by this snapshot."""
+        return sys.getsizeof(self) + sys.getsizeof(self.species) + sys.getsizeof(self.max_counts)
+
+    def _index(self, taxonomic_order):
+        taxonomic_order = float(taxonomic_order)
+        i = bisect.bisect_left(self.species, taxonomic_order)
+        if i < len(self.species) and self.species[i] == taxonomic_order:
+            return i
+        return None
+
+    def has_seen(self, taxonomic_order):
+        return self._index(taxonomic_order) is not None
+
+    def max_count(self, taxonomic_order):
+        """Return the highest count of a species, PRESENT if it was never counted, or None if not seen."""
+        i = self._index(taxonomic_order)
+        if i is None:
+            return None
+        return self.max_counts[i]
+
+    def seen_count(self, taxonomic_orders):
+        """Return how many of taxonomic_orders have been seen."""
+        return sum(1 for t in taxonomic_orders if self.has_seen(t))
+
+
+class SnapshotCache(object):
+    """Least recently used cache of ObservationSnapshots, bounded by their total size."""
+
+    def __init__(self, max_bytes=None, backend=None):
+        self._max_bytes = max_bytes
+        self._backend = backend
+        self._snapshots = collections.OrderedDict()  # user_id: snapshot, least recently used first
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_bytes(self):
+        if self._max_bytes is not None:
+            return self._max_bytes
+        return getattr(settings, 'SNAPSHOT_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+
+    @property
+    def backend(self):
+        alias = self._backend or getattr(settings, 'SNAPSHOT_CACHE_BACKEND', None)
+        if alias:
+            return caches[alias]
+        return None
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._snapshots),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+        }
+
+    def get(self, user):
+        """Return an up to date snapshot of user's observations."""
+        return self.lookup(user.pk, models.DataVersion.current(user), ObservationSnapshot.build)
+
+    def lookup(self, user_id, version, build):
+        with self._lock:
+            snapshot = self._snapshots.get(user_id)
+            if snapshot is not None and snapshot.version == version:
+                self._snapshots.move_to_end(user_id)
+                self.hits += 1
+                return snapshot
+            self.misses += 1
+
+        # Build outside the lock, so one slow user doesn't hold up everyone else
+        backend = self.backend
+        key = 'observation-snapshot:{}:{}'.format(user_id, version)
+        snapshot = backend.get(key) if backend is not None else None
+        if snapshot is None:
+            snapshot = build(user_id, version)
+            if backend is not None:
+                backend.set(key, snapshot)
+        self.store(snapshot)
+        return snapshot
+
+    def store(self, snapshot):
+        with self._lock:
+            old = self._snapshots.get(snapshot.user_id)
+            if old is not None:
+                if old.version > snapshot.version:
+                    return  # Another thread already stored a newer one
+                del self._snapshots[snapshot.user_id]
+                self.bytes -= old.nbytes
+            self._snapshots[snapshot.user_id] = snapshot
+            self.bytes += snapshot.nbytes
+            # Always keep the newest snapshot, even if it's over the limit on its own
+            while self.bytes > self.max_bytes and len(self._snapshots) > 1:
+                _, evicted = self._snapshots.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+            self.bytes = 0
+
+
+cache = SnapshotCache()
+
+
+def get_snapshot(user):
+    return cache.get(user)
@@ -1,3 +1,442 @@
-from django.test import TestCase
+from array import array
+import csv
+from decimal import Decimal
+import io
+import threading
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.shortcuts import reverse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from . import bulk
+from . import db
+from . import models
+from . import snapshot
+from . import validate
+from .importer import write_export
+from .views import parse_batch, parse_filestream
+
+
+def make_export(rows, rows_per_checklist=20):
+    """Return an eBird export CSV with rows observations of Turdus migratorius."""
+    return write_export(
+        {'Submission ID': 'S{}'.format(i // rows_per_checklist + 1), 'Location': 'Location {}'.format(i // rows_per_checklist)}
+        for i in range(rows)
+    )
+
+
+def create_robin():
+    return models.Species.objects.create(
+        taxonomic_order=Decimal('27651'),
+        category='species',
+        scientific_name='Turdus migratorius',
+        common_name='American Robin',
+        ioc_name='American Robin',
+    )
+
+
+class ValidateTest(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('birder')
+        create_robin()
+
+    def validate(self, *rows, **kwargs):
+        return validate.validate_filestream(write_export(rows, **kwargs), self.user)
+
+    def test_valid(self):
+        report = self.validate({}, {'Submission ID': 'S2'})
+        self.assertTrue(report.is_valid, report.errors)
+        self.assertEqual((report.rows, report.checklists, report.new_checklists), (2, 2, 2))
+
+    def test_missing_header(self):
+        report = self.validate({}, fieldnames=validate.REQUIRED_COLUMNS[:-1])
+        self.assertFalse(report.is_valid)
+        self.assertEqual(report.errors, ['Line 1: Missing columns: Checklist Comments'])
+
+    def test_unknown_species(self):
+        report = self.validate({'Scientific Name': 'Turdus imaginarius'}, {'Scientific Name': 'Turdus imaginarius'})
+        self.assertEqual(report.unknown_species, {'Turdus imaginarius'})
+        # Only reported once
+        self.assertEqual(report.error_count, 1)
+
+    def test_bad_count(self):
+        for count in ('-1', 'lots', '1.5'):
+            report = self.validate({'Count': count})
+            self.assertEqual(report.error_count, 1, count)
+
+    def test_bad_numbers(self):
+        bad = [
+            {'Number of Observers': '-2'},
+            {'Duration (Min)': 'an hour'},
+            {'Distance Traveled (km)': '1e400'},
+            {'Distance Traveled (km)': 'NaN'},
+            {'Area Covered (ha)': '12345678901'},
+            {'Latitude': 'nan'},
+            {'Longitude': '181'},
+        ]
+        for changes in bad:
+            report = self.validate(changes)
+            self.assertEqual(report.error_count, 1, changes)
+
+    def test_short_row(self):
+        header, row = write_export([{}]).getvalue().splitlines()
+        export = io.StringIO('\n'.join([header, row, 'S2,Turdus migratorius,1,CA-BC', '']))
+        report = validate.validate_filestream(export, self.user)
+        self.assertEqual(report.rows, 2)
+        self.assertEqual(report.errors, ['Line 3: Expected 19 columns, found 4'])
+
+    def test_extra_fields(self):
+        header, row = write_export([{}]).getvalue().splitlines()
+        export = io.StringIO('\n'.join([header, row + ',extra,fields', '']))
+        report = validate.validate_filestream(export, self.user)
+        self.assertEqual(report.errors, ['Line 2: Expected 19 columns, found 21'])
+
+    def test_checklist_rows_disagree(self):
+        report = self.validate({}, {'Date': '2017-06-02'})
+        self.assertEqual(report.checklists, 1)
+        self.assertEqual(report.errors, ['Line 3: Checklist S1 does not match earlier rows for the same checklist'])
+
+    def test_checklist_of_another_user(self):
+        other = get_user_model().objects.create_user('other')
+        parse_filestream(write_export([{}]), other)
+        report = self.validate({})
+        self.assertEqual(report.new_checklists, 0)
+        self.assertEqual(report.errors, ['Checklist S1 belongs to another user'])
+
+    def test_error_limit(self):
+        report = self.validate(*[{'Count': 'lots'}] * (validate.MAX_ERRORS + 5))
+        self.assertEqual(report.error_count, validate.MAX_ERRORS + 5)
+        self.assertEqual(len(report.errors), validate.MAX_ERRORS)
+
+
+class ConfigureEbirdTest(TestCase):
+
+    def setUp(self):
+        get_user_model().objects.create_user('birder', password='password')
+        self.client.login(username='birder', password='password')
+        create_robin()
+
+    def upload(self, export, **data):
+        upload = SimpleUploadedFile('MyEBirdData.csv', export.getvalue().encode())
+        data['ebirdzip'] = upload
+        return self.client.post(reverse('configure_ebird'), data)
+
+    def test_dry_run(self):
+        response = self.upload(write_export([{}]), dry_run='on')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['report'].is_valid)
+        self.assertFalse(models.Checklist.objects.exists())
+        self.assertFalse(models.Observation.objects.exists())
+
+    def test_invalid_not_imported(self):
+        response = self.upload(write_export([{}, {'Submission ID': 'S2', 'Count': 'lots'}]))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['report'].is_valid)
+        self.assertFalse(models.Checklist.objects.exists())
+        self.assertFalse(models.Observation.objects.exists())
+
+    def test_import(self):
+        response = self.upload(write_export([{}]))
+        self.assertRedirects(response, reverse('progress_list'), fetch_redirect_response=False)
+        self.assertEqual(models.Observation.objects.count(), 1)
+
+
+# Rows covering counts of X and 0, quoted comments, blank and NULL fields, and a duplicated row
+PARITY_ROWS = [
+    {},
+    {'Scientific Name': 'Anas platyrhynchos', 'Count': 'X', 'Species Comments': 'A "quoted", comment', 'Breeding Code': 'FL'},
+    {
+        'Submission ID': 'S2', 'Location': 'Blank fields', 'County': '', 'Time': '', 'Count': '0',
+        'Duration (Min)': '', 'Distance Traveled (km)': '', 'Area Covered (ha)': '2.25', 'Number of Observers': '',
+        'Checklist Comments': 'Windy\nall morning',
+    },
+]
+PARITY_ROWS.append(PARITY_ROWS[-1])
+
+
+def imported_rows():
+    locations = sorted(
+        (l.coords.wkt, l.state_province, l.county, l.locality) for l in models.Location.objects.all())
+    checklists = list(models.Checklist.objects.order_by('id').values_list(
+        'id', 'user_id', 'location__locality', 'complete_checklist', 'start_date_time', 'checklist_comments',
+        'number_of_observers', 'protocol', 'duration', 'distance', 'area'))
+    observations = list(models.Observation.objects.order_by('checklist_id', 'species_id').values_list(
+        'user_id', 'checklist_id', 'species_id', 'count', 'presence', 'species_comments', 'breeding_atlas_code'))
+    return locations, checklists, observations
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'PostgreSQL only')
+class BulkImportTest(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('birder')
+        create_robin()
+        models.Species.objects.create(
+            taxonomic_order=Decimal('310'),
+            category='species',
+            scientific_name='Anas platyrhynchos',
+            common_name='Mallard',
+            ioc_name='Mallard',
+        )
+
+    def parse(self, parse_batch):
+        parse_batch(list(csv.DictReader(write_export(PARITY_ROWS))), self.user)
+        return imported_rows()
+
+    def test_same_as_row_by_row(self):
+        expected = self.parse(parse_batch)
+        models.Observation.objects.all().delete()
+        models.Checklist.objects.all().delete()
+        models.Location.objects.all().delete()
+
+        self.assertEqual(self.parse(bulk.parse_batch), expected)
+        self.assertEqual(len(expected[2]), 3)
+        # Importing again changes nothing
+        self.assertEqual(self.parse(bulk.parse_batch), expected)
+
+    def test_checklist_of_another_user(self):
+        other = get_user_model().objects.create_user('other')
+        bulk.parse_batch(list(csv.DictReader(write_export([{}]))), other)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.parse(bulk.parse_batch)
+        self.assertFalse(models.Observation.objects.filter(user=self.user).exists())
+
+    def test_checklist_at_another_location(self):
+        parse_batch(list(csv.DictReader(write_export([{}]))), self.user)
+        moved = list(csv.DictReader(write_export([{'Location': 'Somewhere else'}])))
+        for import_batch in (parse_batch, bulk.parse_batch):
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                import_batch(moved, self.user)
+        self.assertEqual(list(models.Checklist.objects.values_list('location__locality', flat=True)), ['Location 0'])
+
+
+class ParseFilestreamTest(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('birder')
+        create_robin()
+
+    @override_settings(IMPORT_BATCH_SIZE=20)
+    def test_failed_batch_bumps_version(self):
+        batches = []
+
+        def fail_second_batch(func):
+            batches.append(func)
+            if len(batches) == 2:
+                raise OperationalError('disk I/O error')
+            return func()
+
+        with mock.patch('user_data.views.db.retry_on_locked', fail_second_batch):
+            with self.assertRaises(OperationalError):
+                parse_filestream(make_export(60), self.user)
+        # The first batch is still imported
+        self.assertEqual(models.Observation.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(models.DataVersion.current(self.user), 1)
+
+
+class RetryOnLockedTest(SimpleTestCase):
+
+    def test_retries_until_success(self):
+        func = mock.Mock(side_effect=[OperationalError('database is locked'), 'done'])
+        self.assertEqual(db.retry_on_locked(func, retries=2, delay=0), 'done')
+        self.assertEqual(func.call_count, 2)
+
+    def test_gives_up(self):
+        func = mock.Mock(side_effect=OperationalError('database is locked'))
+        with self.assertRaises(OperationalError):
+            db.retry_on_locked(func, retries=2, delay=0)
+        self.assertEqual(func.call_count, 3)
+
+    def test_other_errors_not_retried(self):
+        func = mock.Mock(side_effect=OperationalError('no such table'))
+        with self.assertRaises(OperationalError):
+            db.retry_on_locked(func, retries=2, delay=0)
+        self.assertEqual(func.call_count, 1)
+
+
+def make_snapshot(user_id, version, species=(1.0, 2.5, 10.0)):
+    return snapshot.ObservationSnapshot(
+        user_id=user_id,
+        version=version,
+        species=array('d', species),
+        max_counts=array('l', [snapshot.PRESENT] + [24] * (len(species) - 1)),
+        life_list=len(species),
+        checklists=1,
+        observations=len(species),
+    )
+
+
+class ObservationSnapshotTest(SimpleTestCase):
+
+    def test_lookups(self):
+        snap = make_snapshot(1, 0)
+        self.assertTrue(snap.has_seen(Decimal('2.5')))
+        self.assertFalse(snap.has_seen(3))
+        self.assertEqual(snap.max_count(1), snapshot.PRESENT)
+        self.assertEqual(snap.max_count(10), 24)
+        self.assertIsNone(snap.max_count(11))
+        self.assertEqual(snap.seen_count([Decimal('1'), Decimal('2'), Decimal('10')]), 2)
+
+
+@mock.patch('user_data.snapshot.SnapshotCache.backend', None)
+class SnapshotCacheTest(SimpleTestCase):
+
+    def test_hit_and_miss(self):
+        cache = snapshot.SnapshotCache(max_bytes=10 ** 6)
+        build = mock.Mock(side_effect=make_snapshot)
+        cache.lookup(1, 0, build)
+        cache.lookup(1, 0, build)
+        self.assertEqual(build.call_count, 1)
+        # New data version
+        self.assertEqual(cache.lookup(1, 1, build).version, 1)
+        self.assertEqual(build.call_count, 2)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 2, 1))
+
+    def test_evicts_least_recently_used(self):
+        size = make_snapshot(1, 0).nbytes
+        cache = snapshot.SnapshotCache(max_bytes=size * 2)
+        for user_id in (1, 2):
+            cache.lookup(user_id, 0, make_snapshot)
+        cache.lookup(1, 0, make_snapshot)
+        cache.lookup(3, 0, make_snapshot)
+        self.assertEqual(list(cache._snapshots), [1, 3])
+        self.assertEqual(cache.evictions, 1)
+        self.assertLessEqual(cache.bytes, cache.max_bytes)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'snapshots': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'snapshots'},
+})
+class SharedSnapshotCacheTest(SimpleTestCase):
+
+    def test_shared_between_caches(self):
+        built = snapshot.SnapshotCache(max_bytes=10 ** 6, backend='snapshots').lookup(1, 0, make_snapshot)
+        # Another process has its own in-memory cache, but the same backend
+        build = mock.Mock(side_effect=make_snapshot)
+        shared = snapshot.SnapshotCache(max_bytes=10 ** 6, backend='snapshots').lookup(1, 0, build)
+        build.assert_not_called()
+        self.assertIsNot(shared, built)
+        self.assertEqual((shared.user_id, shared.version, shared.life_list), (1, 0, 3))
+        self.assertEqual(shared.species, built.species)
+        self.assertEqual(shared.max_count(10), 24)
+
+    def test_new_version_not_shared(self):
+        snapshot.SnapshotCache(max_bytes=10 ** 6, backend='snapshots').lookup(1, 0, make_snapshot)
+        build = mock.Mock(side_effect=make_snapshot)
+        snapshot.SnapshotCache(max_bytes=10 ** 6, backend='snapshots').lookup(1, 1, build)
+        build.assert_called_once_with(1, 1)
+
+
+class SnapshotStatsTest(TestCase):
+
+    def setUp(self):
+        self.addCleanup(snapshot.cache.clear)
+        snapshot.cache.clear()
+
+    def test_staff_only(self):
+        get_user_model().objects.create_user('birder', password='password')
+        self.client.login(username='birder', password='password')
+        self.assertEqual(self.client.get(reverse('snapshot_stats')).status_code, 302)
+
+    def test_stats(self):
+        get_user_model().objects.create_user('admin', password='password', is_staff=True)
+        self.client.login(username='admin', password='password')
+        response = self.client.get(reverse('snapshot_stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), snapshot.cache.stats())
+
+
+def journal_mode():
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode')
+        return cursor.fetchone()[0].lower()
+
+
+def spilling_export(rows):
+    """Return an export with a checklist per row and long comments, so each batch writes many pages."""
+    return write_export(
+        {'Submission ID': 'S{}'.format(i + 1), 'Location': 'Location {}'.format(i // 20), 'Checklist Comments': 'Windy. ' * 300}
+        for i in range(rows)
+    )
+
+
+@override_settings(IMPORT_BATCH_SIZE=100)
+class ReadDuringImportTestCase(TransactionTestCase):
+    """
+    Reads from the main thread while an import is paused in its first batch, before the batch commits.
+
+    The importer's page cache is tiny, so the uncommitted batch spills to the database file. With a rollback journal
+    that takes an exclusive lock, which blocks readers until the import commits. With WAL it goes to the WAL file.
+    """
+
+    def setUp(self):
+        # Reconnect so the pragmas are applied
+        connection.close()
+        self.user = get_user_model().objects.create_user('importer')
+        create_robin()
+
+    def read_during_import(self):
+        """Return how many of the importer's observations a reader sees mid import, or the error reading them."""
+        writing = threading.Event()
+        read = threading.Event()
+
+        def pause_in_first_batch(batch, user):
+            with transaction.atomic():
+                parse_batch(batch, user)
+                if not writing.is_set():
+                    writing.set()
+                    read.wait(30)
+
+        def run_import():
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('PRAGMA cache_size = 10')
+                with mock.patch('user_data.views.parse_batch', pause_in_first_batch):
+                    parse_filestream(spilling_export(300), self.user)
+            finally:
+                connection.close()
+
+        importer = threading.Thread(target=run_import)
+        importer.start()
+        self.assertTrue(writing.wait(30))
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout = 100')
+        try:
+            result = models.Observation.objects.filter(user=self.user).count()
+        except OperationalError as e:
+            result = e
+        importer_was_running = importer.is_alive()
+        read.set()
+        importer.join()
+
+        self.assertTrue(importer_was_running)
+        self.assertEqual(models.Observation.objects.filter(user=self.user).count(), 300)
+        return result
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+@override_settings(SQLITE_PRAGMAS=[('journal_mode', 'WAL'), ('synchronous', 'NORMAL')])
+class ConcurrentImportTest(ReadDuringImportTestCase):
+
+    def test_readers_not_blocked_by_import(self):
+        self.assertEqual(journal_mode(), 'wal')
+        # Uncommitted rows aren't visible
+        self.assertEqual(self.read_during_import(), 0)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+@override_settings(SQLITE_PRAGMAS=[('journal_mode', 'DELETE')])
+class RollbackJournalImportTest(ReadDuringImportTestCase):
+
+    def test_readers_blocked_by_import(self):
+        self.assertEqual(journal_mode(), 'delete')
+        error = self.read_during_import()
+        self.assertIsInstance(error, OperationalError)
+        self.assertTrue(db.is_locked(error))
@@ -5,4 +5,5 @@ from . import views
 urlpatterns = [
     # url(r'^$', views.index, name='users_index'),
     url(r'^ebird/$', views.configure_ebird, name='configure_ebird'),
+    url(r'^snapshot-stats/$', views.snapshot_stats, name='snapshot_stats'),
 ]
@@ -0,0 +1,164 @@
+"""
+Validate an eBird export in a single streaming pass, before anything is written to the database.
+"""
+import csv
+from decimal import Decimal, InvalidOperation
+import math
+
+from dateutil.parser import parse
+
+from . import models
+
+REQUIRED_COLUMNS = [
+    'Submission ID', 'Scientific Name', 'Count', 'State/Province', 'County', 'Location', 'Latitude', 'Longitude',
+    'Date', 'Time', 'Protocol', 'Duration (Min)', 'All Obs Reported', 'Distance Traveled (km)', 'Area Covered (ha)',
+    'Number of Observers', 'Breeding Code', 'Species Comments', 'Checklist Comments',
+]
+
+# Columns that must be the same on every row of a checklist
+CHECKLIST_COLUMNS = ['Date', 'Time', 'Location', 'Latitude', 'Longitude', 'Protocol', 'All Obs Reported']
+
+# Only keep this many error messages, so a completely broken file doesn't use unbounded memory
+MAX_ERRORS = 100
+
+# Number of checklist IDs to look up in the database at once
+QUERY_CHUNK = 500
+
+# Largest value a PositiveIntegerField holds on every database
+MAX_INTEGER = 2147483647
+
+
+class ValidationReport(object):
+    def __init__(self):
+        self.rows = 0
+        self.checklists = 0
+        self.new_checklists = 0
+        self.unknown_species = set()
+        self.error_count = 0
+        self.errors = []
+
+    def __str__(self):
+        return '{s.rows} rows, {s.checklists} checklists ({s.new_checklists} new), {n} unknown species, {s.error_count} errors'.format(
+            s=self, n=len(self.unknown_species))
+
+    @property
+    def is_valid(self):
+        return self.error_count == 0
+
+    def error(self, line, message):
+        self.error_count += 1
+        if line is not None:
+            message = 'Line {}: {}'.format(line, message)
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(message)
+
+
+def _check_integer(report, line, entry, column):
+    """Check column is blank or an integer that fits in a PositiveIntegerField."""
+    value = entry[column]
+    if not value:
+        return
+    try:
+        if not 0 <= int(value) <= MAX_INTEGER:
+            raise ValueError
+    except ValueError:
+        report.error(line, '{} is not a valid positive number: {!r}'.format(column, value))
+
+
+def _check_decimal(report, line, entry, column, field):
+    """Check column is blank or a number that fits in the DecimalField field."""
+    value = entry[column]
+    if not value:
+        return
+    try:
+        number = Decimal(value)
+        if not number.is_finite():
+            raise ValueError
+        # Digits before the decimal point
+        if number and number.adjusted() + 1 > field.max_digits - field.decimal_places:
+            raise ValueError
+    except (ValueError, InvalidOperation):
+        report.error(line, '{} is not a valid number: {!r}'.format(column, value))
+
+
+def validate_filestream(filestream, user):
+    """
+    Check an eBird export CSV without writing anything to the database.
+
+    Returns a ValidationReport. Nothing is held per-row, only the known species names and one hash per checklist.
+    """
+    report = ValidationReport()
+    csvreader = csv.DictReader(filestream)
+
+    missing = [c for c in REQUIRED_COLUMNS if c not in (csvreader.fieldnames or [])]
+    if missing:
+        report.error(1, 'Missing columns: {}'.format(', '.join(missing)))
+        return report
+
+    known_species = set(models.Species.objects.values_list('scientific_name', flat=True))
+    checklists = {}  # Checklist ID: hash of the checklist's columns
+
+    # Header is line 1
+    for line, entry in enumerate(csvreader, start=2):
+        report.rows += 1
+
+        # DictReader fills in missing columns with None, and puts extra ones in a list under None
+        if None in entry or None in entry.values():
+            found = sum(1 for k, v in entry.items() if k is not None and v is not None) + len(entry.get(None, ()))
+            report.error(line, 'Expected {} columns, found {}'.format(len(csvreader.fieldnames), found))
+            continue
+
+        name = entry['Scientific Name']
+        if name not in known_species:
+            if name not in report.unknown_species:
+                report.error(line, 'Unknown species: {}'.format(name))
+            report.unknown_species.add(name)
+
+        submission = entry['Submission ID']
+        if not (submission.startswith('S') and submission[1:].isdigit()):
+            report.error(line, 'Submission ID is not valid: {!r}'.format(submission))
+            continue
+
+        if entry['Count'] != 'X':
+            try:
+                if not 0 <= int(entry['Count']) <= MAX_INTEGER:
+                    raise ValueError
+            except ValueError:
+                report.error(line, 'Count must be X or a positive number: {!r}'.format(entry['Count']))
+
+        checklist_hash = hash(tuple(entry[c] for c in CHECKLIST_COLUMNS))
+        checklist_id = int(submission[1:])
+        if checklist_id in checklists:
+            if checklists[checklist_id] != checklist_hash:
+                report.error(line, 'Checklist {} does not match earlier rows for the same checklist'.format(submission))
+            # Rest of the checklist columns were checked on its first row
+            continue
+        checklists[checklist_id] = checklist_hash
+
+        for column, limit in (('Latitude', 90), ('Longitude', 180)):
+            try:
+                coordinate = float(entry[column])
+                if not math.isfinite(coordinate) or abs(coordinate) > limit:
+                    raise ValueError
+            except ValueError:
+                report.error(line, '{} is not valid: {!r}'.format(column, entry[column]))
+        try:
+            parse(entry['Date'] + ' ' + entry['Time'])
+        except (ValueError, OverflowError):
+            report.error(line, 'Date and time are not valid: {!r} {!r}'.format(entry['Date'], entry['Time']))
+        _check_integer(report, line, entry, 'Duration (Min)')
+        _check_integer(report, line, entry, 'Number of Observers')
+        _check_decimal(report, line, entry, 'Distance Traveled (km)', models.Checklist._meta.get_field('distance'))
+        _check_decimal(report, line, entry, 'Area Covered (ha)', models.Checklist._meta.get_field('area'))
+
+    report.checklists = len(checklists)
+    existing_count = 0
+    ids = list(checklists)
+    for i in range(0, len(ids), QUERY_CHUNK):
+        existing = models.Checklist.objects.filter(id__in=ids[i:i + QUERY_CHUNK]).values_list('id', 'user_id')
+        for checklist_id, user_id in existing:
+            existing_count += 1
+            if user_id != user.id:
+                report.error(None, 'Checklist S{} belongs to another user'.format(checklist_id))
+    report.new_checklists = report.checklists - existing_count
+    return report
@@ -1,23 +1,34 @@
 import csv
-import datetime
-from decimal import Decimal
+import functools
 import io
+import itertools
 import zipfile
 
 from django import forms
+from django.conf import settings
 from django.core.validators import RegexValidator, URLValidator
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.gis.geos import Point
-from django.http import HttpResponseRedirect
+from django.db import connection, transaction
+from django.http import HttpResponseRedirect, JsonResponse
 from django.shortcuts import render, reverse
 
-from dateutil.parser import parse
 import requests
 
+from . import bulk
+from . import db
 from . import models
+from . import snapshot
+from . import validate
+from .importer import checklist_fields, observation_fields
+
+DRY_RUN_LABEL = "Only check the export, don't import it"
+
 
 class UploadFileForm(forms.Form):
     ebirdzip = forms.FileField(label='eBird export data CSV file or ZIP file')
+    dry_run = forms.BooleanField(label=DRY_RUN_LABEL, required=False)
 
 class UploadURLForm(forms.Form):
     ebirdurl = forms.CharField(
@@ -28,40 +39,73 @@ class UploadURLForm(forms.Form):
             RegexValidator(regex=r'https?://ebird\.org/downloads/ebird_\d{10,15}\.zip', message='URL must be for an eBird download'),
         ]
     )
+    dry_run = forms.BooleanField(label=DRY_RUN_LABEL, required=False)
 
 
 @login_required
 def configure_ebird(request):
     url_form = UploadURLForm(request.POST or None)
-    file_form = UploadFileForm(request.POST or None)
+    file_form = UploadFileForm(request.POST or None, request.FILES or None)
+    report = None
     if request.method == 'POST':
         if url_form.is_valid() or file_form.is_valid():
             if url_form.is_valid():
+                dry_run = url_form.cleaned_data['dry_run']
                 response = requests.get(url_form.cleaned_data['ebirdurl'])
-                stream = io.BytesIO(response.content)
-                zfile = zipfile.ZipFile(stream)
-                filestream = zfile.open('MyEBirdData.csv')
+                zfile = zipfile.ZipFile(io.BytesIO(response.content))
+                open_export = lambda: zfile.open('MyEBirdData.csv')
             elif file_form.is_valid():
+                dry_run = file_form.cleaned_data['dry_run']
                 uploaded_file = request.FILES['ebirdzip']
                 if uploaded_file.name.endswith('.zip'):
                     zfile = zipfile.ZipFile(uploaded_file)
-                    filestream = zfile.open('MyEBirdData.csv')
+                    open_export = lambda: zfile.open('MyEBirdData.csv')
                 elif uploaded_file.name.endswith('.csv'):
-                    filestream = uploaded_file
+                    def open_export():
+                        uploaded_file.seek(0)
+                        return uploaded_file
                 else:
                     raise TypeError('Must be zip or csv file')
 
-            stringify = io.TextIOWrapper(filestream)  # Open as str not bytes
-            parse_filestream(stringify, request.user)
-            return HttpResponseRedirect(reverse('progress_list'))
+            # Check the whole export before writing any of it
+            checkstream = io.TextIOWrapper(open_export())
+            report = validate.validate_filestream(checkstream, request.user)
+            checkstream.detach()  # Don't close the upload, it's read again to import
+            if report.is_valid and not dry_run:
+                stringify = io.TextIOWrapper(open_export())  # Open as str not bytes
+                parse_filestream(stringify, request.user)
+                return HttpResponseRedirect(reverse('progress_list'))
 
     return render(request, 'user_data/configure_ebird.html',
-        {'url_form': url_form, 'file_form': file_form})
+        {'url_form': url_form, 'file_form': file_form, 'report': report})
+
+@staff_member_required
+def snapshot_stats(request):
+    # The cache is per process, so these are the stats of whichever process served the request
+    return JsonResponse(snapshot.cache.stats())
 
 def parse_filestream(filestream, user):
     # Magic the data into the DB
     csvreader = csv.DictReader(filestream)
-    for entry in csvreader:
+    batch_size = getattr(settings, 'IMPORT_BATCH_SIZE', 500)
+    if connection.vendor == 'postgresql':
+        import_batch = bulk.parse_batch
+    else:
+        import_batch = parse_batch
+    try:
+        while True:
+            batch = list(itertools.islice(csvreader, batch_size))
+            if not batch:
+                break
+            # Commit in batches so readers and other writers get a turn at the database during a long import
+            db.retry_on_locked(functools.partial(import_batch, batch, user))
+    finally:
+        # Earlier batches are committed even if a later one fails, so their data has still changed
+        models.DataVersion.bump(user)
+
+@transaction.atomic
+def parse_batch(batch, user):
+    for entry in batch:
         # Species
         species = models.Species.objects.get(scientific_name=entry['Scientific Name'])
 
@@ -78,50 +122,18 @@ def parse_filestream(filestream, user):
             }
         )
 
-        def decimal_or_none(d):
-            if d:
-                return Decimal(d)
-            else:
-                return None
-
         # Checklist
-        start = parse(entry['Date'] + ' ' + entry['Time'])
-        if entry['Duration (Min)']:
-            duration = datetime.timedelta(minutes=int(entry['Duration (Min)']))
-        else:
-            duration = None
-
-        distance = decimal_or_none(entry['Distance Traveled (km)'])
-        area = decimal_or_none(entry['Area Covered (ha)'])
         checklist, _ = models.Checklist.objects.get_or_create(
             id=int(entry['Submission ID'][1:]),  # Strip leading S
             user=user,
             location=location,
-            defaults={
-                'complete_checklist': True if entry['All Obs Reported'] == '1' else False,
-                'start_date_time': start,
-                'checklist_comments': entry['Checklist Comments'] or '',
-                'number_of_observers': entry['Number of Observers'],
-                'protocol': entry['Protocol'],
-                'duration': duration,
-                'distance': distance,
-                'area': area,
-            }
+            defaults=checklist_fields(entry),
         )
 
         # Observation
-        if entry['Count'] == 'X':
-            count = None
-        else:
-            count = int(entry['Count'])
         models.Observation.objects.get_or_create(
             user=user,
             checklist=checklist,
             species=species,
-            defaults={
-                'count': count,
-                'presence': entry['Count'] != '0',
-                'species_comments': entry['Species Comments'] or '',
-                'breeding_atlas_code': entry['Breeding Code'] or '',
-            }
+            defaults=observation_fields(entry),
         )